@@ -22,19 +22,32 @@ import sys
 import logging
 from datetime import datetime
 import json
+import zlib
 from pathlib import Path
 
-# Configure logging for easy debugging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(f'ised_log_{datetime.now().strftime("%Y%m%d")}.log')
-    ]
-)
+try:
+    import orjson  # Optional: much faster JSON serialization
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np  # Optional: vectorized checksum for oversized frames
+except ImportError:
+    np = None
+
 logger = logging.getLogger(__name__)
 
+def setup_logging():
+    """Configure console and daily log file output (called from main, not at import)"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),
+            logging.FileHandler(f'ised_log_{datetime.now().strftime("%Y%m%d")}.log')
+        ]
+    )
+
 # iSED Protocol Control Characters (from specification)
 class ProtocolChars:
     ENQ = b'\x05'   # Enquiry - iSED requests to send data
@@ -63,23 +76,89 @@ ESR_ERROR_CODES = {
     '-12': 'Trigger delay error'
 }
 
+# Log prefix per result interpretation status (see _interpret_result)
+STATUS_EMOJI = {
+    'normal': '✅',
+    'below': '⚠️',
+    'above': '⚠️',
+    'error': '⚠️',
+    'invalid': '⚠️'
+}
+
+# Upper-case two-digit hex checksum for every possible byte value
+# (public: shared with main.py together with byte_sum)
+HEX_BYTES = [b"%02X" % i for i in range(256)]
+
+# Largest chunk whose byte sum stays below the Adler-32 modulus (65521)
+_ADLER_CHUNK = 256
+# Below this size a NumPy call costs more than the chunked adler32 loop
+_NUMPY_MIN_BYTES = 2048
+
+def byte_sum(data):
+    """Sum of all byte values in data, computed in C via zlib.adler32
+
+    The low word of Adler-32 is 1 + sum(data) mod 65521, so for chunks of
+    up to 256 bytes it carries the exact byte sum.
+    """
+    # Fast path: a standard LIS2-A2 frame fits in a single chunk
+    if len(data) <= _ADLER_CHUNK:
+        return (zlib.adler32(data) & 0xFFFF) - 1
+    
+    # Oversized frames: a single vectorized reduction, no copy of the buffer
+    if np is not None and len(data) >= _NUMPY_MIN_BYTES:
+        return int(np.frombuffer(data, dtype=np.uint8).sum(dtype=np.uint64))
+    
+    view = memoryview(data)  # Slice long frames without copying
+    total = 0
+    for start in range(0, len(view), _ADLER_CHUNK):
+        total += (zlib.adler32(view[start:start + _ADLER_CHUNK]) & 0xFFFF) - 1
+    return total
+
+def write_json(path, data):
+    """Write data to path as indented JSON, using orjson when available"""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
 class iSEDHandler:
+    # Record processors read at most fields[25] (Order report type)
+    MAX_RECORD_SPLITS = 26
+    # Upper bound on a single frame; LIS2-A2 frames are well under 1 KiB
+    MAX_FRAME = 4096
+    
     def __init__(self):
         self.serial_port = None
-        self.current_session = self._init_session()
+        self.current_session = {'header': {}, 'patients': [], 'orders': [], 'results': []}
+        self._reset_session()
         self.frame_timeout = 10  # seconds
         self.max_retries = 6     # per specification
+        self._rx_buffer = bytearray()  # Bytes read from the port but not yet consumed
+        self._transmission_started_iso = None  # Shared timestamp for one transmission
         
-    def _init_session(self):
-        """Initialize a new data session"""
-        return {
-            'header': {},
-            'patients': [],
-            'orders': [],
-            'results': [],
-            'session_start': datetime.now().isoformat(),
-            'session_id': datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Record type -> processor, built once instead of on every record
+        self._processors = {
+            'H': self._process_header,
+            'P': self._process_patient, 
+            'O': self._process_order,
+            'R': self._process_result,
+            'L': self._process_terminator
         }
+        
+    def _reset_session(self):
+        """Start a new data session, reusing the existing containers"""
+        session = self.current_session
+        session['header'] = {}
+        session['patients'].clear()
+        session['orders'].clear()
+        session['results'].clear()
+        session.pop('session_end', None)
+        
+        now = datetime.now()
+        session['session_start'] = now.isoformat()
+        session['session_id'] = now.strftime("%Y%m%d_%H%M%S")
     
     def select_serial_port(self):
         """Interactive serial port selection"""
@@ -139,15 +218,31 @@ class iSEDHandler:
         logger.info("Listening for iSED transmissions... (Press Ctrl+C to exit)")
         
         try:
+            # Bind hot-loop lookups once
+            rx_buffer = self._rx_buffer
+            port = self.serial_port
+            read = port.read
+            ENQ = ProtocolChars.ENQ
+            
             while True:
                 # Wait for ENQ from iSED (iSED is always master)
-                data = self.serial_port.read(1)
+                enq_pos = rx_buffer.find(ENQ)
                 
-                if data == ProtocolChars.ENQ:
-                    logger.info("📡 ENQ received from iSED - starting data reception")
-                    self._handle_transmission()
-                elif data:
-                    logger.debug(f"Unexpected data received: {data.hex()}")
+                if enq_pos == -1:
+                    if rx_buffer:
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("Unexpected data received: %s", rx_buffer.hex())
+                        rx_buffer.clear()
+                    # Drain everything the driver already holds in a single read
+                    rx_buffer.extend(read(max(port.in_waiting, 1)))
+                    continue
+                
+                if enq_pos and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Unexpected data received: %s", rx_buffer[:enq_pos].hex())
+                del rx_buffer[:enq_pos + 1]
+                
+                logger.info("📡 ENQ received from iSED - starting data reception")
+                self._handle_transmission()
                     
         except KeyboardInterrupt:
             logger.info("User interrupted - shutting down")
@@ -159,63 +254,96 @@ class iSEDHandler:
     def _handle_transmission(self):
         """Handle complete data transmission from iSED"""
         try:
+            # Bind per-frame lookups once
+            write = self.serial_port.write
+            read_frame = self._read_frame
+            process_frame = self._process_frame
+            ACK = ProtocolChars.ACK
+            NAK = ProtocolChars.NAK
+            # Frame types are checked as ints against the first byte
+            STX_CODE = ProtocolChars.STX[0]
+            EOT_CODE = ProtocolChars.EOT[0]
+            
             # Send ACK to accept transmission
-            self.serial_port.write(ProtocolChars.ACK)
+            write(ACK)
             logger.info("✅ ACK sent - ready for data frames")
             
             frame_count = 0
+            # All records in one transmission share this wall-clock timestamp
+            self._transmission_started_iso = datetime.now().isoformat()
             
             while True:
                 # Read complete frame (ends with LF)
-                frame_data = self.serial_port.read_until(ProtocolChars.LF)
+                frame_data = read_frame()
                 
                 if not frame_data:
                     logger.warning("⏰ Timeout waiting for frame")
                     break
                 
+                frame_type = frame_data[0]
+                
                 # Check for end of transmission
-                if frame_data.startswith(ProtocolChars.EOT):
+                if frame_type == EOT_CODE:
                     logger.info("🏁 EOT received - transmission complete")
-                    self.serial_port.write(ProtocolChars.ACK)
+                    write(ACK)
                     self._finalize_session()
                     break
                 
                 # Process STX data frames
-                if frame_data.startswith(ProtocolChars.STX):
+                if frame_type == STX_CODE:
                     frame_count += 1
-                    success = self._process_frame(frame_data, frame_count)
+                    success = process_frame(frame_data, frame_count)
                     
                     if success:
-                        self.serial_port.write(ProtocolChars.ACK)
+                        write(ACK)
                         logger.info(f"✅ Frame {frame_count} processed successfully")
                     else:
-                        self.serial_port.write(ProtocolChars.NAK)
+                        write(NAK)
                         logger.error(f"❌ Frame {frame_count} rejected - will be retransmitted")
                 
         except Exception as e:
             logger.error(f"Error handling transmission: {e}")
     
+    def _read_frame(self):
+        """Read one LF-terminated frame, consuming already buffered bytes first"""
+        lf_pos = self._rx_buffer.find(ProtocolChars.LF)
+        
+        if lf_pos != -1:
+            frame_data = bytes(self._rx_buffer[:lf_pos + 1])
+            del self._rx_buffer[:lf_pos + 1]
+            return frame_data
+        
+        # Cap the read so a lost LF cannot grow the buffer until timeout
+        frame_data = self.serial_port.read_until(ProtocolChars.LF, size=self.MAX_FRAME)
+        if self._rx_buffer:
+            frame_data = bytes(self._rx_buffer) + frame_data
+            self._rx_buffer.clear()
+        return frame_data
+    
     def _process_frame(self, frame_data, frame_num):
         """Process individual data frame with checksum verification"""
         try:
+            # Locate frame markers once; the checksum and data slicing share them
+            stx_pos = frame_data.find(ProtocolChars.STX)
+            etx_pos = frame_data.find(ProtocolChars.ETX)
+            
             # Verify checksum first
-            if not self._verify_checksum(frame_data):
+            if not self._verify_checksum(frame_data, stx_pos, etx_pos):
                 logger.error(f"Checksum verification failed for frame {frame_num}")
                 return False
             
             # Extract frame components
             frame_number = chr(frame_data[1])  # Frame number after STX
-            stx_pos = frame_data.find(ProtocolChars.STX)
-            etx_pos = frame_data.find(ProtocolChars.ETX)
             
-            # Extract data message
-            data_section = frame_data[stx_pos + 2:etx_pos].decode('ascii', errors='ignore')
-            data_section = data_section.rstrip('\r')  # Remove trailing CR
+            # Extract data message (kept as bytes; records are decoded individually)
+            data_section = frame_data[stx_pos + 2:etx_pos]
             
-            logger.debug(f"Frame {frame_number}: {data_section[:80]}...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Frame %s: %s...", frame_number,
+                             data_section[:80].decode('ascii', errors='ignore'))
             
-            # Process each record in the frame
-            records = [r for r in data_section.split('\r') if r]
+            # Process each record in the frame (empty splits cover the trailing CR)
+            records = [r for r in data_section.split(b'\r') if r]
             
             for record in records:
                 self._process_record(record)
@@ -226,52 +354,46 @@ class iSEDHandler:
             logger.error(f"Error processing frame: {e}")
             return False
     
-    def _verify_checksum(self, frame_data):
+    def _verify_checksum(self, frame_data, stx_pos, etx_pos):
         """Verify frame checksum according to iSED specification"""
         try:
-            stx_pos = frame_data.find(ProtocolChars.STX)
-            etx_pos = frame_data.find(ProtocolChars.ETX)
-            
             if stx_pos == -1 or etx_pos == -1:
                 return False
             
-            # Extract received checksum (2 hex chars after ETX)
+            # Extract received checksum (2 hex chars after ETX), compared as bytes
             checksum_start = etx_pos + 1
-            received_checksum = frame_data[checksum_start:checksum_start + 2].decode('ascii')
+            received_checksum = frame_data[checksum_start:checksum_start + 2].upper()
             
             # Calculate checksum: sum of bytes from frame_number to ETX (inclusive)
             data_for_checksum = frame_data[stx_pos + 1:etx_pos + 1]
-            calculated_sum = sum(data_for_checksum) % 256
-            calculated_checksum = f"{calculated_sum:02X}"
+            calculated_sum = byte_sum(data_for_checksum) & 0xFF
+            calculated_checksum = HEX_BYTES[calculated_sum]
             
-            is_valid = received_checksum.upper() == calculated_checksum.upper()
+            is_valid = received_checksum == calculated_checksum
             
             if not is_valid:
-                logger.debug(f"Checksum mismatch: received={received_checksum}, calculated={calculated_checksum}")
+                logger.debug("Checksum mismatch: received=%s, calculated=%s",
+                             received_checksum.decode('ascii', errors='replace'),
+                             calculated_checksum.decode('ascii'))
             
             return is_valid
             
         except:
             return False
     
-    def _process_record(self, record):
+    def _process_record(self, record_bytes):
         """Process individual record based on type"""
+        record = record_bytes.decode('ascii', errors='ignore')
         if not record:
             return
             
         record_type = record[0]
-        fields = record.split('|')
+        processor = self._processors.get(record_type)
         
-        processors = {
-            'H': self._process_header,
-            'P': self._process_patient, 
-            'O': self._process_order,
-            'R': self._process_result,
-            'L': self._process_terminator
-        }
-        
-        processor = processors.get(record_type)
         if processor:
+            fields = record.split('|', self.MAX_RECORD_SPLITS)
+            # Pad once so processors can index fields directly without length checks
+            fields += [''] * (self.MAX_RECORD_SPLITS - len(fields))
             processor(fields)
         else:
             logger.warning(f"Unknown record type: {record_type}")
@@ -279,16 +401,16 @@ class iSEDHandler:
     def _process_header(self, fields):
         """Process Header record (H) - analyzer information"""
         # Parse sender info: Alcor^iSED^SWver^instrument#
-        sender_parts = fields[4].split('^') if len(fields) > 4 else []
+        sender_parts = fields[4].split('^') + ['Unknown'] * 3
         
         header = {
-            'manufacturer': sender_parts[0] if len(sender_parts) > 0 else 'Unknown',
-            'product': sender_parts[1] if len(sender_parts) > 1 else 'Unknown',
-            'software_version': sender_parts[2] if len(sender_parts) > 2 else 'Unknown',
-            'instrument_id': sender_parts[3] if len(sender_parts) > 3 else 'Unknown',
-            'message_datetime': fields[13] if len(fields) > 13 else '',
-            'processing_id': fields[11] if len(fields) > 11 else '',
-            'version_number': fields[12] if len(fields) > 12 else ''
+            'manufacturer': sender_parts[0],
+            'product': sender_parts[1],
+            'software_version': sender_parts[2],
+            'instrument_id': sender_parts[3],
+            'message_datetime': fields[13],
+            'processing_id': fields[11],
+            'version_number': fields[12]
         }
         
         self.current_session['header'] = header
@@ -298,12 +420,12 @@ class iSEDHandler:
     def _process_patient(self, fields):
         """Process Patient record (P) - patient demographics"""
         patient = {
-            'sequence': fields[1] if len(fields) > 1 else '',
-            'patient_id': fields[3] if len(fields) > 3 else '',  # Lab assigned ID
-            'patient_name': fields[5] if len(fields) > 5 else '',
-            'birthdate': fields[7] if len(fields) > 7 else '',
-            'sex': fields[8] if len(fields) > 8 else '',
-            'attending_physician': fields[13] if len(fields) > 13 else ''
+            'sequence': fields[1],
+            'patient_id': fields[3],  # Lab assigned ID
+            'patient_name': fields[5],
+            'birthdate': fields[7],
+            'sex': fields[8],
+            'attending_physician': fields[13]
         }
         
         self.current_session['patients'].append(patient)
@@ -312,14 +434,14 @@ class iSEDHandler:
     def _process_order(self, fields):
         """Process Order record (O) - test orders"""
         # Parse sample info: Sample_ID^rotor_location
-        sample_parts = fields[2].split('^') if len(fields) > 2 else []
+        sample_parts = fields[2].split('^') + ['']
         
         order = {
-            'sequence': fields[1] if len(fields) > 1 else '',
-            'sample_id': sample_parts[0] if len(sample_parts) > 0 else '',
-            'rotor_location': sample_parts[1] if len(sample_parts) > 1 else '',
-            'test_id': fields[4] if len(fields) > 4 else '',  # Should be ^^^ESR
-            'report_type': fields[25] if len(fields) > 25 else ''
+            'sequence': fields[1],
+            'sample_id': sample_parts[0],
+            'rotor_location': sample_parts[1],
+            'test_id': fields[4],  # Should be ^^^ESR
+            'report_type': fields[25]
         }
         
         self.current_session['orders'].append(order)
@@ -328,49 +450,55 @@ class iSEDHandler:
     
     def _process_result(self, fields):
         """Process Result record (R) - ESR test results"""
+        status, interpretation = self._interpret_result(fields[3], fields[6])
+        
         result = {
-            'sequence': fields[1] if len(fields) > 1 else '',
-            'test_id': fields[2] if len(fields) > 2 else '',  # ^^^ESR^4537-7
-            'value': fields[3] if len(fields) > 3 else '',
-            'units': fields[4] if len(fields) > 4 else '',    # mm/h
-            'abnormal_flag': fields[6] if len(fields) > 6 else '',  # < or >
-            'status': fields[8] if len(fields) > 8 else '',   # P=Preliminary, X=Cannot do
-            'test_start': fields[11] if len(fields) > 11 else '',
-            'test_complete': fields[12] if len(fields) > 12 else '',
-            'instrument_id': fields[13] if len(fields) > 13 else '',
-            'interpretation': self._interpret_result(fields[3], fields[6]),
-            'timestamp': datetime.now().isoformat()
+            'sequence': fields[1],
+            'test_id': fields[2],  # ^^^ESR^4537-7
+            'value': fields[3],
+            'units': fields[4],    # mm/h
+            'abnormal_flag': fields[6],  # < or >
+            'status': fields[8],   # P=Preliminary, X=Cannot do
+            'test_start': fields[11],
+            'test_complete': fields[12],
+            'instrument_id': fields[13],
+            'interpretation': interpretation,
+            'interpretation_status': status,  # normal, below, above, error or invalid
+            'timestamp': self._transmission_started_iso or datetime.now().isoformat()
         }
         
         self.current_session['results'].append(result)
         
         # Log result with interpretation
-        status_emoji = "✅" if result['interpretation'].startswith('Normal') else "⚠️"
+        status_emoji = STATUS_EMOJI[status]
         logger.info(f"{status_emoji} ESR Result: {result['value']} {result['units']} "
                    f"({result['interpretation']}) [Instrument: {result['instrument_id']}]")
     
     def _interpret_result(self, value, abnormal_flag):
-        """Interpret ESR result value and flags"""
+        """Interpret ESR result value and flags, returning (status, message)"""
         # Check for error codes (negative values)
         if value.startswith('-'):
-            return ESR_ERROR_CODES.get(value, f'Unknown error: {value}')
+            return 'error', ESR_ERROR_CODES.get(value, f'Unknown error: {value}')
         
         # Check range flags
         if abnormal_flag == '<':
-            return 'Below range (< 1 mm/hr)'
+            return 'below', 'Below range (< 1 mm/hr)'
         elif abnormal_flag == '>':
-            return 'Above range (> 130 mm/hr)'
+            return 'above', 'Above range (> 130 mm/hr)'
         
-        # Normal numeric result
+        # Normal numeric result; plain digits skip the exception path, anything
+        # else still gets float()'s full parsing (signs, padding, exponents)
+        if value.replace('.', '', 1).isdigit():
+            return 'normal', f'Normal measurement: {float(value)} mm/hr'
         try:
             numeric_value = float(value)
-            return f'Normal measurement: {numeric_value} mm/hr'
         except ValueError:
-            return f'Invalid format: {value}'
+            return 'invalid', f'Invalid format: {value}'
+        return 'normal', f'Normal measurement: {numeric_value} mm/hr'
     
     def _process_terminator(self, fields):
         """Process Terminator record (L) - end of transmission"""
-        termination_code = fields[2] if len(fields) > 2 else ''
+        termination_code = fields[2]
         logger.info(f"🏁 Transmission terminated (Code: {termination_code})")
     
     def _finalize_session(self):
@@ -380,20 +508,18 @@ class iSEDHandler:
             
             # Save detailed session data
             session_file = f"ised_session_{self.current_session['session_id']}.json"
-            with open(session_file, 'w') as f:
-                json.dump(self.current_session, f, indent=2)
+            write_json(session_file, self.current_session)
             
             # Create and save summary
             summary = self._create_session_summary()
             summary_file = f"ised_summary_{self.current_session['session_id']}.json"
-            with open(summary_file, 'w') as f:
-                json.dump(summary, f, indent=2)
+            write_json(summary_file, summary)
             
             logger.info(f"💾 Session saved: {len(self.current_session['results'])} results processed")
             logger.info(f"📊 Files created: {session_file}, {summary_file}")
             
             # Reset for next session
-            self.current_session = self._init_session()
+            self._reset_session()
             
         except Exception as e:
             logger.error(f"Error saving session: {e}")
@@ -401,6 +527,8 @@ class iSEDHandler:
     def _create_session_summary(self):
         """Create human-readable session summary"""
         header = self.current_session.get('header', {})
+        results = self.current_session['results']
+        successful_tests = sum(1 for r in results if r['interpretation_status'] == 'normal')
         
         summary = {
             'session_info': {
@@ -414,25 +542,29 @@ class iSEDHandler:
             'statistics': {
                 'total_patients': len(self.current_session['patients']),
                 'total_orders': len(self.current_session['orders']),
-                'total_results': len(self.current_session['results']),
-                'successful_tests': len([r for r in self.current_session['results'] 
-                                       if r['interpretation'].startswith('Normal')]),
-                'error_tests': len([r for r in self.current_session['results'] 
-                                  if not r['interpretation'].startswith('Normal')])
+                'total_results': len(results),
+                'successful_tests': successful_tests,
+                'error_tests': len(results) - successful_tests
             },
             'results': []
         }
         
+        # Index patients and orders by sequence once (reversed so the first match wins)
+        patients_by_seq = {p['sequence']: p for p in reversed(self.current_session['patients'])}
+        orders_by_seq = {o['sequence']: o for o in reversed(self.current_session['orders'])}
+        
+        no_match = {}  # Shared default so unmatched lookups do not allocate
+        summary_results = summary['results']
+        
         # Add individual results
-        for i, result in enumerate(self.current_session['results']):
+        for test_number, result in enumerate(results, 1):
             # Find corresponding patient and order info
-            patient = next((p for p in self.current_session['patients'] 
-                          if p['sequence'] == result['sequence']), {})
-            order = next((o for o in self.current_session['orders'] 
-                        if o['sequence'] == result['sequence']), {})
+            sequence = result['sequence']
+            patient = patients_by_seq.get(sequence, no_match)
+            order = orders_by_seq.get(sequence, no_match)
             
-            summary['results'].append({
-                'test_number': i + 1,
+            summary_results.append({
+                'test_number': test_number,
                 'patient_name': patient.get('patient_name', 'N/A'),
                 'patient_id': patient.get('patient_id', 'N/A'),
                 'sample_id': order.get('sample_id', 'N/A'),
@@ -453,6 +585,8 @@ class iSEDHandler:
 
 def main():
     """Main entry point"""
+    setup_logging()
+    
     print("="*60)
     print("iSED ESR Analyzer Communication Handler")
     print("Medical Laboratory Integration System")
@@ -2,8 +2,15 @@ import serial
 import serial.tools.list_ports
 import sys
 import logging
+import os
 from datetime import datetime
 import json
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+
+# Checksum helpers shared with the class-based handler (importing clean has no side effects)
+from clean import byte_sum, HEX_BYTES
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +49,21 @@ ser = serial.Serial(port=selected_port, baudrate=9600, bytesize=serial.EIGHTBITS
                    parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, 
                    timeout=10, xonxoff=True)
 
+# Raw descriptor for one-byte ACK/NAK writes; pyserial has none on Windows
+try:
+    port_fd = ser.fileno()
+except (AttributeError, OSError):
+    port_fd = None
+
+# Ask the Linux driver to hand over received bytes immediately instead of
+# batching them (USB adapters otherwise hold data for up to 16 ms); XON/XOFF
+# stays on as the iSED requires it, and the kernel - not pyserial - handles it
+if sys.platform.startswith('linux'):
+    try:
+        ser.set_low_latency_mode(True)
+    except (AttributeError, NotImplementedError, ValueError, OSError) as e:
+        logger.debug("Low-latency mode not available on %s: %s", selected_port, e)
+
 # Control characters (iSED specification)
 ENQ = b'\x05'  # ENQ - Enquiry
 ACK = b'\x06'  # ACK - Acknowledge
@@ -54,15 +76,124 @@ LF = b'\x0A'   # Line Feed
 XON = b'\x11'  # XON - Resume transmission
 XOFF = b'\x13' # XOFF - Pause transmission
 
-# Data storage for current session
+# ESR error codes (from specification)
+ESR_ERROR_CODES = {
+    '-1': 'ESR_ERR_NOFLOW',
+    '-2': 'ESR_ERR_NOSPIKE', 
+    '-3': 'ESR_ERR_REVERSE',
+    '-4': 'ESR_ERR_NOPOINTS',
+    '-5': 'ESR_ERR_TOODARK',
+    '-7': 'ESR_ERR_TOOCLEAR',
+    '-8': 'ESR_ERR_WITHDRAWAL',
+    '-9': 'ESR_ERR_FLOW_IN',
+    '-10': 'ESR_ERR_FLOW_OUT',
+    '-11': 'ESR_ERR_ACQUISITION',
+    '-12': 'ESR_ERR_TRIGGERDELAY'
+}
+
+# Table folding lower-case hex digits a-f to A-F
+HEX_UPPER = bytes.maketrans(b"abcdef", b"ABCDEF")
+# Frame number byte -> str; iSED numbers frames '0'-'7', anything else shows as '?'
+FRAME_NUM_STR = [chr(c) if 0x30 <= c <= 0x37 else '?' for c in range(256)]
+
+# Data storage for current session; full records are streamed to the JSONL
+# file, so memory only holds what the summary needs
 current_session = {
     'header': {},
-    'patients': [],
-    'orders': [],
-    'results': [],
+    'patient_count': 0,
+    'order_count': 0,
+    'sample_ids': {},       # Order sequence number -> sample ID (first order wins)
+    'result_rows': [],      # One compact ResultRow per result
     'session_start': datetime.now().isoformat()
 }
 
+# JSONL file for the current session, opened when its first record arrives
+session_stream = None
+
+# Single background worker for session summaries; drained before exit
+save_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ised-save")
+atexit.register(save_pool.shutdown, wait=True)
+
+def write_session_record(kind, info):
+    """Append one record to the current session's JSONL file, opening it on first use"""
+    global session_stream
+    
+    line = json.dumps({kind: info}, separators=(',', ':'))
+    
+    # A failed write (disk full, permissions) must not break the ACK/NAK exchange
+    # with the analyzer; the record goes to the log instead so it is not lost
+    try:
+        if session_stream is None:
+            current_session['session_id'] = datetime.now().strftime("%Y%m%d_%H%M%S")
+            session_stream = open(f"ised_session_{current_session['session_id']}.jsonl", 'w',
+                                  buffering=65536)
+            session_stream.write(json.dumps({'session_start': current_session['session_start']},
+                                            separators=(',', ':')) + '\n')
+        
+        session_stream.write(line + '\n')
+        session_stream.flush()  # Keep every complete record on disk as it arrives
+    except OSError as e:
+        logger.error("Error writing %s record to session file (%s): %s", kind, e, line)
+
+def close_session_stream():
+    """Close the current session's JSONL file; returns its name, or None if it never opened"""
+    global session_stream
+    
+    if session_stream is None:
+        return None
+    
+    # Detach first so the next session always starts a new file
+    stream, session_stream = session_stream, None
+    try:
+        stream.close()
+    except OSError as e:
+        logger.error("Error closing session file %s: %s", stream.name, e)
+    return stream.name
+
+def send_control(control_char):
+    """Send a one-byte control character (ACK/NAK) with a single write syscall"""
+    if port_fd is not None:
+        try:
+            if os.write(port_fd, control_char):
+                return
+        except BlockingIOError:
+            pass  # Output held back (e.g. by XOFF); let pyserial wait for room
+    ser.write(control_char)
+
+# Receive buffer: filled with bulk reads, split into frames with bytearray.find
+rx_buffer = bytearray()
+
+def read_available():
+    """Append everything the driver holds (waiting for at least one byte) to rx_buffer"""
+    chunk = ser.read(max(ser.in_waiting, 1))
+    rx_buffer.extend(chunk)
+    return len(chunk)
+
+def read_frame():
+    """
+    Take the next frame from rx_buffer, reading from the port as needed
+    Returns an LF-terminated frame, a bare EOT (which has no LF), or whatever
+    arrived before a read timeout (empty on a silent line)
+    """
+    scan_from = 0
+    while True:
+        if rx_buffer[:1] == EOT:
+            del rx_buffer[:1]
+            return EOT
+        
+        lf_pos = rx_buffer.find(LF, scan_from)
+        if lf_pos != -1:
+            frame = bytes(rx_buffer[:lf_pos + 1])
+            del rx_buffer[:lf_pos + 1]
+            return frame
+        
+        # Only scan newly arrived bytes next time round
+        scan_from = len(rx_buffer)
+        if not read_available():
+            frame = bytes(rx_buffer)
+            rx_buffer.clear()
+            return frame
+
 def process_ised_data():
     """Main processing loop for iSED data communication"""
     logger.info("Starting iSED data processing...")
@@ -70,16 +201,20 @@ def process_ised_data():
     while True:
         try:
             # Wait for ENQ from iSED (iSED is master)
-            data = ser.read(1)
-            if data == ENQ:
+            enq_pos = rx_buffer.find(ENQ)
+            if enq_pos == -1:
+                rx_buffer.clear()  # Nothing outside a transmission is meaningful
+                read_available()
+            else:
+                del rx_buffer[:enq_pos + 1]
                 logger.info("Received ENQ from iSED, sending ACK")
-                ser.write(ACK)
+                send_control(ACK)
                 
                 # Process data frames until EOT
                 frame_count = 0
                 while True:
-                    # Read until we get a complete frame (ending with LF)
-                    frame = ser.read_until(LF)
+                    # Get the next complete frame (ending with LF) or EOT
+                    frame = read_frame()
                     
                     if not frame:
                         logger.warning("Timeout occurred while waiting for frame")
@@ -88,360 +223,409 @@ def process_ised_data():
                     # Check if this is EOT
                     if frame.startswith(EOT):
                         logger.info("Received EOT, transmission complete")
-                        ser.write(ACK)
+                        send_control(ACK)
                         break
                     
                     # Process STX frames
                     if frame.startswith(STX):
                         frame_count += 1
-                        logger.debug(f"Processing frame {frame_count}")
+                        logger.debug("Processing frame %s", frame_count)
+                        
+                        # Locate markers once for both checksum and parsing:
+                        # STX is the first byte, ETX sits just before the checksum
+                        stx_pos = 0
+                        etx_pos = frame.rfind(ETX)
                         
-                        if verify_checksum(frame):
-                            logger.info(f"Frame {frame_count} checksum verified, sending ACK")
-                            ser.write(ACK)
-                            process_frame(frame)
+                        if verify_checksum(frame, stx_pos, etx_pos):
+                            logger.info("Frame %s checksum verified, sending ACK", frame_count)
+                            send_control(ACK)
+                            process_frame(frame, stx_pos, etx_pos)
                         else:
-                            logger.error(f"Frame {frame_count} checksum failed, sending NAK")
-                            ser.write(NAK)
+                            logger.error("Frame %s checksum failed, sending NAK", frame_count)
+                            send_control(NAK)
                             # iSED will retransmit the same frame (same frame number)
                     
         except KeyboardInterrupt:
             logger.info("Process interrupted by user")
             break
         except Exception as e:
-            logger.error(f"Error in processing: {e}")
+            logger.error("Error in processing: %s", e)
             continue
 
-def verify_checksum(frame):
+def verify_checksum(frame, stx_pos, etx_pos):
     """
     Verify iSED frame checksum
     Checksum = sum of ASCII values from after STX to ETX (inclusive), modulo 256
     Format: <STX>1...Data...<CR><ETX>X1X2<CR><LF>
     """
-    try:
-        # Find positions of key markers
-        stx_pos = frame.find(STX)
-        etx_pos = frame.find(ETX)
-        
-        if stx_pos == -1 or etx_pos == -1:
-            logger.error("Invalid frame format - missing STX or ETX")
-            return False
-        
-        # Extract checksum (2 hex chars after ETX)
-        checksum_start = etx_pos + 1
-        received_checksum = frame[checksum_start:checksum_start + 2].decode('ascii')
-        
-        # Calculate checksum from frame number to ETX (inclusive)
-        # This includes: frame_number + data + CR + ETX
-        data_for_checksum = frame[stx_pos + 1:etx_pos + 1]
-        calculated_sum = sum(data_for_checksum) % 256
-        calculated_checksum = f"{calculated_sum:02X}"
-        
-        logger.debug(f"Received checksum: {received_checksum}, Calculated: {calculated_checksum}")
-        return received_checksum.upper() == calculated_checksum.upper()
-        
-    except Exception as e:
-        logger.error(f"Checksum verification error: {e}")
+    # A frame too short to hold both checksum digits after ETX cannot match
+    if stx_pos == -1 or etx_pos == -1 or len(frame) < etx_pos + 3:
+        logger.error("Invalid frame format - missing STX, ETX or checksum")
         return False
+    
+    # Extract checksum (2 hex chars after ETX), kept as bytes
+    checksum_start = etx_pos + 1
+    received_checksum = frame[checksum_start:checksum_start + 2]
+    
+    # Calculate checksum from frame number to ETX (inclusive)
+    # This includes: frame_number + data + CR + ETX
+    data_for_checksum = frame[stx_pos + 1:etx_pos + 1]
+    calculated_sum = byte_sum(data_for_checksum) & 0xFF
+    calculated_checksum = HEX_BYTES[calculated_sum]
+    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received checksum: %s, Calculated: %s",
+                     received_checksum.decode('ascii', errors='replace'),
+                     calculated_checksum.decode('ascii'))
+    # The analyzer sends upper-case hex; only fold case when that fails
+    return (received_checksum == calculated_checksum or
+            received_checksum.translate(HEX_UPPER) == calculated_checksum)
 
-def process_frame(frame):
+def process_frame(frame, stx_pos, etx_pos):
     """Process iSED data frame"""
+    # Extract frame number (byte after STX)
+    frame_number = FRAME_NUM_STR[frame[1]]
+    logger.info("Processing frame number: %s", frame_number)
+    
+    # One timestamp for every record in this frame
+    frame_ts = datetime.now().isoformat()
+    
+    # Extract data message (between frame number and ETX), decoded once for
+    # the whole frame; the split fields are already the str values we store
     try:
-        # Extract frame number (byte after STX)
-        frame_number = chr(frame[1])
-        logger.info(f"Processing frame number: {frame_number}")
-        
-        # Extract data message (between frame number and ETX)
-        stx_pos = frame.find(STX)
-        etx_pos = frame.find(ETX)
         data_message = frame[stx_pos + 2:etx_pos].decode('ascii')
-        
-        # Remove trailing CR if present
-        if data_message.endswith('\r'):
-            data_message = data_message[:-1]
-        
-        # Split into records (separated by CR)
-        records = data_message.split('\r')
-        
-        for record in records:
-            if not record:
-                continue
-                
-            record_type = record[0]
-            logger.debug(f"Processing record type: {record_type} - {record[:50]}...")
+    except UnicodeDecodeError as e:
+        logger.error("Error processing frame: %s", e)
+        return
+    
+    # Split into records (separated by CR); the empty record after the
+    # trailing CR is skipped below, so no stripped copy is needed
+    records = data_message.split('\r')
+    
+    for record in records:
+        if not record:
+            continue
             
-            if record_type == 'H':
-                process_header_record(record)
-            elif record_type == 'P':
-                process_patient_record(record)
-            elif record_type == 'O':
-                process_order_record(record)
-            elif record_type == 'R':
-                process_result_record(record)
-            elif record_type == 'L':
-                process_terminator_record(record)
-            else:
-                logger.warning(f"Unknown record type: {record_type}")
-                
-    except Exception as e:
-        logger.error(f"Error processing frame: {e}")
+        record_type = record[0]
+        logger.debug("Processing record type: %s - %.50s...", record_type, record)
+        
+        handler = RECORD_HANDLERS.get(record_type)
+        if handler:
+            # One bad record is logged and skipped; the rest of the frame and
+            # the ENQ...EOT exchange carry on
+            try:
+                handler(record, frame_ts)
+            except Exception:
+                logger.exception("Error processing %s record: %.50s", record_type, record)
+        else:
+            logger.warning("Unknown record type: %s", record_type)
+
+# Record layouts: field names in transmission order, with '^' components
+# (header sender name, order sample ID) expanded in place
+HEADER_FIELDS = (
+    'record_type',
+    'delimiter_definition',
+    'message_control_id',
+    'access_password',
+    'manufacturer',                   # Sender name: Alcor^iSED^SWver^instrument#
+    'product_name',
+    'software_version',
+    'instrument_id',
+    'sender_address',
+    'reserved',
+    'sender_phone',
+    'characteristics',
+    'receiver_id',
+    'comments',
+    'processing_id',                  # Should be 'P'
+    'version_number',                 # Should be 'E 1394-97'
+    'message_datetime',               # YYYYMMDDHHMMSS
+)
+
+PATIENT_FIELDS = (
+    'record_type',
+    'sequence_number',
+    'practice_patient_id',
+    'laboratory_patient_id',          # Patient ID (max 30)
+    'patient_id_3',
+    'patient_name',
+    'mother_maiden_name',
+    'birthdate',
+    'patient_sex',
+    'patient_race',
+    'patient_address',
+    'reserved',
+    'patient_phone',
+    'attending_physician_id',
+    'special_field_1',
+    'special_field_2',
+    'patient_height',
+    'patient_weight',
+    'diagnosis',
+    'active_medications',
+    'patient_diet',
+    'practice_field_1',
+    'practice_field_2',
+    'admission_discharge_dates',
+    'admission_status',
+    'location',
+    'diagnostic_code_nature_1',
+    'diagnostic_code_nature_2',
+    'patient_religion',
+    'marital_status',
+    'isolation_status',
+    'language',
+    'hospital_service',
+    'hospital_institution',
+    'dosage_category',
+)
+
+ORDER_FIELDS = (
+    'record_type',
+    'sequence_number',
+    'sample_id',                      # Sample ID ^ rotor location
+    'rotor_location',
+    'instrument_specimen_id',
+    'universal_test_id',              # Should be '^^^ESR'
+    'priority',
+    'requested_datetime',
+    'specimen_collection_datetime',
+    'collection_end_time',
+    'collection_volume',
+    'collector_id',
+    'action_code',
+    'danger_code',
+    'clinical_info',
+    'specimen_received_datetime',
+    'specimen_descriptor',
+    'ordering_physician',
+    'physician_phone',
+    'user_field_1',
+    'user_field_2',
+    'laboratory_field_1',
+    'laboratory_field_2',
+    'result_reported_datetime',
+    'instrument_charge',
+    'instrument_section_id',
+    'report_types',                   # P: Preliminary result
+    'reserved',
+    'specimen_location',
+    'nosocomial_infection_flag',
+    'specimen_service',
+    'specimen_institution',
+)
+
+RESULT_FIELDS = (
+    'record_type',
+    'sequence_number',
+    'universal_test_id',              # ^^^ESR^4537-7 (LOINC)
+    'result_value',                   # ESR result 0-130 or error codes
+    'units',                          # mm/h
+    'reference_range',
+    'abnormal_flag',                  # '<' or '>' for out of range
+    'abnormality_nature',
+    'result_status',                  # P: Preliminary, X: Cannot do
+    'normative_change_date',
+    'operator_id',
+    'test_start_datetime',            # YYYYMMDDHHMMSS
+    'test_complete_datetime',         # YYYYMMDDHHMMSS
+    'instrument_id',                  # 01-99
+)
+
+TERMINATOR_FIELDS = (
+    'record_type',
+    'sequence_number',                # Should be '1'
+    'termination_code',               # N: normal
+)
+
+# Stored session records; lighter than a dict per record, converted with
+# _asdict() when written out (results also carry timestamp and interpretation)
+PatientRecord = namedtuple('PatientRecord', PATIENT_FIELDS)
+OrderRecord = namedtuple('OrderRecord', ORDER_FIELDS)
+ResultRecord = namedtuple('ResultRecord', RESULT_FIELDS + ('timestamp', 'interpretation'))
+# The part of each result kept in memory for the session summary
+ResultRow = namedtuple('ResultRow', ('sequence_number', 'result_value', 'units',
+                                     'interpretation', 'test_complete'))
 
-def process_header_record(record):
+def split_fields(text, delimiter, count):
+    """Split text into at least count fields, padding missing ones with ''"""
+    # maxsplit=count keeps the first count fields intact and bounds the work
+    fields = text.split(delimiter, count)
+    fields.extend([''] * (count - len(fields)))
+    return fields
+
+def process_header_record(record, frame_ts=None):
     """Process iSED Header record (H)"""
-    fields = record.split('|')
+    fields = split_fields(record, '|', 14)  # Fields 0-13
     
     # Parse sender name field (Alcor^iSED^SWver^instrument#)
-    sender_info = fields[4].split('^') if len(fields) > 4 else []
+    sender_info = split_fields(fields[4], '^', 4)
     
-    header_info = {
-        'record_type': fields[0] if len(fields) > 0 else '',
-        'delimiter_definition': fields[1] if len(fields) > 1 else '',
-        'message_control_id': fields[2] if len(fields) > 2 else '',
-        'access_password': fields[3] if len(fields) > 3 else '',
-        'manufacturer': sender_info[0] if len(sender_info) > 0 else '',
-        'product_name': sender_info[1] if len(sender_info) > 1 else '',
-        'software_version': sender_info[2] if len(sender_info) > 2 else '',
-        'instrument_id': sender_info[3] if len(sender_info) > 3 else '',
-        'sender_address': fields[5] if len(fields) > 5 else '',
-        'reserved': fields[6] if len(fields) > 6 else '',
-        'sender_phone': fields[7] if len(fields) > 7 else '',
-        'characteristics': fields[8] if len(fields) > 8 else '',
-        'receiver_id': fields[9] if len(fields) > 9 else '',
-        'comments': fields[10] if len(fields) > 10 else '',
-        'processing_id': fields[11] if len(fields) > 11 else '',  # Should be 'P'
-        'version_number': fields[12] if len(fields) > 12 else '',  # Should be 'E 1394-97'
-        'message_datetime': fields[13] if len(fields) > 13 else ''   # YYYYMMDDHHMMSS
-    }
+    header_info = dict(zip(HEADER_FIELDS, fields[:4] + sender_info[:4] + fields[5:]))
     
     current_session['header'] = header_info
-    logger.info(f"Header processed: {header_info['manufacturer']} {header_info['product_name']} "
-                f"v{header_info['software_version']} (ID: {header_info['instrument_id']})")
+    write_session_record('header', header_info)
+    logger.info("Header processed: %s %s v%s (ID: %s)",
+                header_info['manufacturer'], header_info['product_name'],
+                header_info['software_version'], header_info['instrument_id'])
 
-def process_patient_record(record):
+def process_patient_record(record, frame_ts=None):
     """Process iSED Patient record (P)"""
-    fields = record.split('|')
-    
-    patient_info = {
-        'record_type': fields[0] if len(fields) > 0 else '',
-        'sequence_number': fields[1] if len(fields) > 1 else '',
-        'practice_patient_id': fields[2] if len(fields) > 2 else '',
-        'laboratory_patient_id': fields[3] if len(fields) > 3 else '',  # Patient ID (max 30)
-        'patient_id_3': fields[4] if len(fields) > 4 else '',
-        'patient_name': fields[5] if len(fields) > 5 else '',
-        'mother_maiden_name': fields[6] if len(fields) > 6 else '',
-        'birthdate': fields[7] if len(fields) > 7 else '',
-        'patient_sex': fields[8] if len(fields) > 8 else '',
-        'patient_race': fields[9] if len(fields) > 9 else '',
-        'patient_address': fields[10] if len(fields) > 10 else '',
-        'reserved': fields[11] if len(fields) > 11 else '',
-        'patient_phone': fields[12] if len(fields) > 12 else '',
-        'attending_physician_id': fields[13] if len(fields) > 13 else '',
-        'special_field_1': fields[14] if len(fields) > 14 else '',
-        'special_field_2': fields[15] if len(fields) > 15 else '',
-        'patient_height': fields[16] if len(fields) > 16 else '',
-        'patient_weight': fields[17] if len(fields) > 17 else '',
-        'diagnosis': fields[18] if len(fields) > 18 else '',
-        'active_medications': fields[19] if len(fields) > 19 else '',
-        'patient_diet': fields[20] if len(fields) > 20 else '',
-        'practice_field_1': fields[21] if len(fields) > 21 else '',
-        'practice_field_2': fields[22] if len(fields) > 22 else '',
-        'admission_discharge_dates': fields[23] if len(fields) > 23 else '',
-        'admission_status': fields[24] if len(fields) > 24 else '',
-        'location': fields[25] if len(fields) > 25 else '',
-        'diagnostic_code_nature_1': fields[26] if len(fields) > 26 else '',
-        'diagnostic_code_nature_2': fields[27] if len(fields) > 27 else '',
-        'patient_religion': fields[28] if len(fields) > 28 else '',
-        'marital_status': fields[29] if len(fields) > 29 else '',
-        'isolation_status': fields[30] if len(fields) > 30 else '',
-        'language': fields[31] if len(fields) > 31 else '',
-        'hospital_service': fields[32] if len(fields) > 32 else '',
-        'hospital_institution': fields[33] if len(fields) > 33 else '',
-        'dosage_category': fields[34] if len(fields) > 34 else ''
-    }
+    fields = split_fields(record, '|', len(PATIENT_FIELDS))
+    patient_info = PatientRecord._make(fields[:len(PATIENT_FIELDS)])
     
-    current_session['patients'].append(patient_info)
-    logger.info(f"Patient processed: {patient_info['patient_name']} "
-                f"(ID: {patient_info['laboratory_patient_id']})")
+    current_session['patient_count'] += 1
+    write_session_record('patient', patient_info._asdict())
+    logger.info("Patient processed: %s (ID: %s)",
+                patient_info.patient_name, patient_info.laboratory_patient_id)
 
-def process_order_record(record):
+def process_order_record(record, frame_ts=None):
     """Process iSED Order record (O)"""
-    fields = record.split('|')
+    fields = split_fields(record, '|', 31)  # Fields 0-30
     
     # Parse Sample ID field (Sample ID ^ rotor location)
-    sample_info = fields[2].split('^') if len(fields) > 2 else []
+    sample_info = split_fields(fields[2], '^', 2)
     
-    order_info = {
-        'record_type': fields[0] if len(fields) > 0 else '',
-        'sequence_number': fields[1] if len(fields) > 1 else '',
-        'sample_id': sample_info[0] if len(sample_info) > 0 else '',
-        'rotor_location': sample_info[1] if len(sample_info) > 1 else '',
-        'instrument_specimen_id': fields[3] if len(fields) > 3 else '',
-        'universal_test_id': fields[4] if len(fields) > 4 else '',  # Should be '^^^ESR'
-        'priority': fields[5] if len(fields) > 5 else '',
-        'requested_datetime': fields[6] if len(fields) > 6 else '',
-        'specimen_collection_datetime': fields[7] if len(fields) > 7 else '',
-        'collection_end_time': fields[8] if len(fields) > 8 else '',
-        'collection_volume': fields[9] if len(fields) > 9 else '',
-        'collector_id': fields[10] if len(fields) > 10 else '',
-        'action_code': fields[11] if len(fields) > 11 else '',
-        'danger_code': fields[12] if len(fields) > 12 else '',
-        'clinical_info': fields[13] if len(fields) > 13 else '',
-        'specimen_received_datetime': fields[14] if len(fields) > 14 else '',
-        'specimen_descriptor': fields[15] if len(fields) > 15 else '',
-        'ordering_physician': fields[16] if len(fields) > 16 else '',
-        'physician_phone': fields[17] if len(fields) > 17 else '',
-        'user_field_1': fields[18] if len(fields) > 18 else '',
-        'user_field_2': fields[19] if len(fields) > 19 else '',
-        'laboratory_field_1': fields[20] if len(fields) > 20 else '',
-        'laboratory_field_2': fields[21] if len(fields) > 21 else '',
-        'result_reported_datetime': fields[22] if len(fields) > 22 else '',
-        'instrument_charge': fields[23] if len(fields) > 23 else '',
-        'instrument_section_id': fields[24] if len(fields) > 24 else '',
-        'report_types': fields[25] if len(fields) > 25 else '',  # P: Preliminary result
-        'reserved': fields[26] if len(fields) > 26 else '',
-        'specimen_location': fields[27] if len(fields) > 27 else '',
-        'nosocomial_infection_flag': fields[28] if len(fields) > 28 else '',
-        'specimen_service': fields[29] if len(fields) > 29 else '',
-        'specimen_institution': fields[30] if len(fields) > 30 else ''
-    }
+    order_info = OrderRecord._make(fields[:2] + sample_info[:2] + fields[3:31])
     
-    current_session['orders'].append(order_info)
-    logger.info(f"Order processed: Sample {order_info['sample_id']} "
-                f"(Rotor: {order_info['rotor_location']}, Test: {order_info['universal_test_id']})")
+    current_session['order_count'] += 1
+    current_session['sample_ids'].setdefault(order_info.sequence_number, order_info.sample_id)
+    write_session_record('order', order_info._asdict())
+    logger.info("Order processed: Sample %s (Rotor: %s, Test: %s)",
+                order_info.sample_id, order_info.rotor_location, order_info.universal_test_id)
 
-def process_result_record(record):
+def process_result_record(record, frame_ts=None):
     """Process iSED Result record (R) - ESR test results"""
-    fields = record.split('|')
+    fields = split_fields(record, '|', len(RESULT_FIELDS))
     
-    result_info = {
-        'record_type': fields[0] if len(fields) > 0 else '',
-        'sequence_number': fields[1] if len(fields) > 1 else '',
-        'universal_test_id': fields[2] if len(fields) > 2 else '',  # ^^^ESR^4537-7 (LOINC)
-        'result_value': fields[3] if len(fields) > 3 else '',        # ESR result 0-130 or error codes
-        'units': fields[4] if len(fields) > 4 else '',               # mm/h
-        'reference_range': fields[5] if len(fields) > 5 else '',
-        'abnormal_flag': fields[6] if len(fields) > 6 else '',       # '<' or '>' for out of range
-        'abnormality_nature': fields[7] if len(fields) > 7 else '',
-        'result_status': fields[8] if len(fields) > 8 else '',       # P: Preliminary, X: Cannot do
-        'normative_change_date': fields[9] if len(fields) > 9 else '',
-        'operator_id': fields[10] if len(fields) > 10 else '',
-        'test_start_datetime': fields[11] if len(fields) > 11 else '', # YYYYMMDDHHMMSS
-        'test_complete_datetime': fields[12] if len(fields) > 12 else '', # YYYYMMDDHHMMSS
-        'instrument_id': fields[13] if len(fields) > 13 else '',      # 01-99
-        'timestamp': datetime.now().isoformat()
-    }
+    # Interpret result value (fields 3 and 6: result_value, abnormal_flag)
+    result_interpretation = interpret_esr_result(fields[3], fields[6])
     
-    # Interpret result value
-    result_interpretation = interpret_esr_result(result_info['result_value'], 
-                                               result_info['abnormal_flag'])
-    result_info['interpretation'] = result_interpretation
+    result_info = ResultRecord(*fields[:len(RESULT_FIELDS)],
+                               frame_ts or datetime.now().isoformat(),
+                               result_interpretation)
     
-    current_session['results'].append(result_info)
-    logger.info(f"Result processed: ESR = {result_info['result_value']} {result_info['units']} "
-                f"({result_interpretation}) [Instrument: {result_info['instrument_id']}]")
+    current_session['result_rows'].append(ResultRow(
+        result_info.sequence_number, result_info.result_value, result_info.units,
+        result_interpretation, result_info.test_complete_datetime))
+    write_session_record('result', result_info._asdict())
+    logger.info("Result processed: ESR = %s %s (%s) [Instrument: %s]",
+                result_info.result_value, result_info.units,
+                result_interpretation, result_info.instrument_id)
 
 def interpret_esr_result(result_value, abnormal_flag):
     """Interpret ESR result value and flags"""
+    # Check for error codes (negative values) - known codes need a single lookup
+    error_code = ESR_ERROR_CODES.get(result_value)
+    if error_code:
+        return error_code
+    if result_value.startswith('-'):
+        return f'Unknown error code: {result_value}'
+    
+    # Check for range indicators
+    if abnormal_flag == '<':
+        return 'Below measurement range (< 1 mm/hr)'
+    elif abnormal_flag == '>':
+        return 'Above measurement range (> 130 mm/hr)'
+    
+    # Normal numeric result
     try:
-        # Check for error codes (negative values)
-        if result_value.startswith('-'):
-            error_codes = {
-                '-1': 'ESR_ERR_NOFLOW',
-                '-2': 'ESR_ERR_NOSPIKE', 
-                '-3': 'ESR_ERR_REVERSE',
-                '-4': 'ESR_ERR_NOPOINTS',
-                '-5': 'ESR_ERR_TOODARK',
-                '-7': 'ESR_ERR_TOOCLEAR',
-                '-8': 'ESR_ERR_WITHDRAWAL',
-                '-9': 'ESR_ERR_FLOW_IN',
-                '-10': 'ESR_ERR_FLOW_OUT',
-                '-11': 'ESR_ERR_ACQUISITION',
-                '-12': 'ESR_ERR_TRIGGERDELAY'
-            }
-            return error_codes.get(result_value, f'Unknown error code: {result_value}')
-        
-        # Check for range indicators
-        if abnormal_flag == '<':
-            return 'Below measurement range (< 1 mm/hr)'
-        elif abnormal_flag == '>':
-            return 'Above measurement range (> 130 mm/hr)'
-        
-        # Normal numeric result
-        try:
-            value = float(result_value)
-            return f'Normal measurement: {value} mm/hr'
-        except ValueError:
-            return f'Invalid result format: {result_value}'
-            
-    except Exception as e:
-        return f'Error interpreting result: {e}'
+        value = float(result_value)
+        return f'Normal measurement: {value} mm/hr'
+    except ValueError:
+        return f'Invalid result format: {result_value}'
 
-def process_terminator_record(record):
+def process_terminator_record(record, frame_ts=None):
     """Process iSED Terminator record (L)"""
-    fields = record.split('|')
+    terminator_info = dict(zip(TERMINATOR_FIELDS, split_fields(record, '|', len(TERMINATOR_FIELDS))))
+    terminator_info['timestamp'] = frame_ts or datetime.now().isoformat()
     
-    terminator_info = {
-        'record_type': fields[0] if len(fields) > 0 else '',
-        'sequence_number': fields[1] if len(fields) > 1 else '',  # Should be '1'
-        'termination_code': fields[2] if len(fields) > 2 else '', # N: normal
-        'timestamp': datetime.now().isoformat()
-    }
-    
-    logger.info(f"Terminator processed: Code '{terminator_info['termination_code']}' "
-                f"(Sequence: {terminator_info['sequence_number']})")
+    logger.info("Terminator processed: Code '%s' (Sequence: %s)",
+                terminator_info['termination_code'], terminator_info['sequence_number'])
     
     # Session complete - save data
     save_session_data()
 
+# Record type -> handler, used by process_frame; every handler takes
+# (record, frame_ts) so the frame's timestamp can be passed through
+RECORD_HANDLERS = {
+    'H': process_header_record,
+    'P': process_patient_record,
+    'O': process_order_record,
+    'R': process_result_record,
+    'L': process_terminator_record
+}
+
 def save_session_data():
-    """Save current iSED session data"""
+    """Close the session's JSONL record file and queue its summary for writing"""
     try:
         current_session['session_end'] = datetime.now().isoformat()
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"ised_session_{timestamp}.json"
         
-        with open(filename, 'w') as f:
-            json.dump(current_session, f, indent=2)
-            
+        # Records were streamed as they arrived; finish and close the file
+        write_session_record('session_end', current_session['session_end'])
+        filename = close_session_stream()
+        if filename is None:
+            # The file could not be opened; still give the summary its own name
+            current_session['session_id'] = datetime.now().strftime("%Y%m%d_%H%M%S")
+        
+        # Snapshot the session, then reset it in place for the next transmission;
+        # the stored rows are immutable, so copying the containers is enough
+        snapshot = current_session.copy()
+        snapshot['filename'] = filename
+        snapshot['header'] = dict(current_session['header'])
+        snapshot['sample_ids'] = dict(current_session['sample_ids'])
+        snapshot['result_rows'] = list(current_session['result_rows'])
+        current_session['header'].clear()
+        current_session['sample_ids'].clear()
+        current_session['result_rows'].clear()
+        current_session['patient_count'] = 0
+        current_session['order_count'] = 0
+        current_session['session_start'] = datetime.now().isoformat()
+        
+        # Build and write the summary off the serial thread so the next ENQ
+        # is answered straight away
+        save_pool.submit(write_session_summary, snapshot)
+        
+    except Exception as e:
+        logger.error("Error saving session data: %s", e)
+
+def write_session_summary(session):
+    """Build and save the summary of a finished session (runs on save_pool)"""
+    try:
         # Create summary
         summary = {
-            'session_time': current_session['session_end'],
-            'instrument': f"{current_session['header'].get('manufacturer', 'N/A')} "
-                         f"{current_session['header'].get('product_name', 'N/A')}",
-            'software_version': current_session['header'].get('software_version', 'N/A'),
-            'instrument_id': current_session['header'].get('instrument_id', 'N/A'),
-            'total_patients': len(current_session['patients']),
-            'total_orders': len(current_session['orders']),
-            'total_results': len(current_session['results']),
+            'session_time': session['session_end'],
+            'instrument': f"{session['header'].get('manufacturer', 'N/A')} "
+                         f"{session['header'].get('product_name', 'N/A')}",
+            'software_version': session['header'].get('software_version', 'N/A'),
+            'instrument_id': session['header'].get('instrument_id', 'N/A'),
+            'total_patients': session['patient_count'],
+            'total_orders': session['order_count'],
+            'total_results': len(session['result_rows']),
             'results_summary': []
         }
         
         # Add result summaries
-        for result in current_session['results']:
+        sample_ids = session['sample_ids']
+        for row in session['result_rows']:
             summary['results_summary'].append({
-                'sample_id': next((o['sample_id'] for o in current_session['orders'] 
-                                 if o['sequence_number'] == result['sequence_number']), 'N/A'),
-                'result_value': result['result_value'],
-                'units': result['units'],
-                'interpretation': result['interpretation'],
-                'test_complete': result['test_complete_datetime']
+                'sample_id': sample_ids.get(row.sequence_number, 'N/A'),
+                'result_value': row.result_value,
+                'units': row.units,
+                'interpretation': row.interpretation,
+                'test_complete': row.test_complete
             })
         
-        logger.info(f"Session data saved to {filename}")
-        logger.info(f"Session summary: {summary['total_results']} ESR results from "
-                   f"{summary['instrument']} (ID: {summary['instrument_id']})")
+        summary_filename = f"ised_summary_{session['session_id']}.json"
+        with open(summary_filename, 'w') as f:
+            json.dump(summary, f, indent=2)
         
-        # Reset session for next transmission
-        current_session.update({
-            'header': {},
-            'patients': [],
-            'orders': [],
-            'results': [],
-            'session_start': datetime.now().isoformat()
-        })
+        logger.info("Session data saved to %s, summary to %s", session['filename'], summary_filename)
+        logger.info("Session summary: %s ESR results from %s (ID: %s)",
+                    summary['total_results'], summary['instrument'], summary['instrument_id'])
         
     except Exception as e:
-        logger.error(f"Error saving session data: {e}")
+        logger.error("Error saving session summary: %s", e)
 
 def close_connection():
     """Close serial connection"""
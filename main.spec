@@ -10,7 +10,10 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # clean.py (imported for its checksum helpers) tries the optional orjson and
+    # numpy; main.py never writes through orjson and its frames are far below
+    # the size where numpy is used, so keep both out of the bundle
+    excludes=['orjson', 'numpy'],
     noarchive=False,
     optimize=0,
 )